@@ -1,16 +1,17 @@
 """Tool for automating submitting assessments to the University of York Computer Science department."""
 
-import hashlib
+import errno
+import os
 import re
+import stat
 import sys
-import urllib.parse
 from pathlib import Path
 from typing import Optional
 
 from .argparse import Namespace, get_parser
 from .constants import URL_SUBMIT_BASE, URL_SUBMIT_EXAMPLE, __version__
+from .cookies import get_token_file
 from .credentials import delete_keyring_entries, ensure_username
-from .requests import run_requests_session
 
 REGEX_SUBMIT_URL = re.compile(
     r"((((((https?:)?//)?teaching\.cs\.york\.ac\.uk)?/)?student)?/)?"
@@ -40,6 +41,7 @@ def deletion_subcommands(args: Namespace) -> bool:
             print("Deleted cookie file.")
         except FileNotFoundError:
             print("Cookie file doesn't exist.")
+        get_token_file(cookie_file).unlink(missing_ok=True)
     # delete keyring entries?
     if args.delete_from_keyring:
         exit_now = True
@@ -53,19 +55,31 @@ def deletion_subcommands(args: Namespace) -> bool:
     return exit_now
 
 
-def print_file_hash(file_path: Path):
-    """Resolve the file path and print its checksum.
+def resolve_file_path(file_path: Path) -> Optional[Path]:
+    """Resolve the file path, and print it with the file's size.
 
-    :param file_path: path object to resolve and hash
-    :return: a fully resolved path object of the same path
+    The file is hashed later, while it is being uploaded.
+    Pipes such as ``/dev/stdin`` or process substitution are allowed,
+    but aren't resolved, as the resolved path can't be opened.
+
+    :param file_path: path object to resolve
+    :raises FileNotFoundError: if the file does not exist
+    :raises OSError: if the file can't be read for any other reason,
+        e.g. PermissionError, or NotADirectoryError if a parent is a file
+    :return: a fully resolved path object of the same path,
+        or None if it is neither a regular file nor a pipe, e.g. a directory
     """
+    file_stat = os.stat(file_path)
+    # checked rather than opened, as opening and closing a named pipe could break its writer
+    if not os.access(file_path, os.R_OK):
+        raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), str(file_path))
+    if stat.S_ISFIFO(file_stat.st_mode) or stat.S_ISCHR(file_stat.st_mode):
+        print(f"Found file '{file_path}'.")
+        return file_path
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
     file_path = file_path.resolve()
-    print(f"Found file '{file_path}'.")
-    # display hash of file
-    with open(file_path, "rb") as file:
-        # noinspection PyTypeChecker
-        digest = hashlib.file_digest(file, hashlib.md5).hexdigest()
-    print(f"MD5 hash of file: {digest}")
+    print(f"Found file '{file_path}' ({file_stat.st_size} bytes).")
     return file_path
 
 
@@ -84,6 +98,10 @@ def resolve_submit_url(submit_url: str, base: str = URL_SUBMIT_BASE) -> Optional
     ... ):
     ...     assert resolve_submit_url(url) == result
     >>> assert resolve_submit_url("toooodle pip") is None
+    >>> for base in ("http://localhost:8000", "http://localhost:8000/"):
+    ...     resolve_submit_url("2021-2/submit/COM00012C/901/A", base=base)
+    'http://localhost:8000/student/2021-2/submit/COM00012C/901/A'
+    'http://localhost:8000/student/2021-2/submit/COM00012C/901/A'
 
     :param submit_url: URL to submit to,
         with or without base URL and leading/trailing forward slashes.
@@ -94,8 +112,8 @@ def resolve_submit_url(submit_url: str, base: str = URL_SUBMIT_BASE) -> Optional
     if match is None:
         return None
     path = match.group("path")
-    path = f"student/{path}/A"
-    submit_url = urllib.parse.urljoin(base, path)
+    base = base.rstrip("/")
+    submit_url = f"{base}/student/{path}/A"
 
     return submit_url
 
@@ -108,9 +126,13 @@ def main_exit_code() -> int:
     If ``FileNotFoundError`` is raised,
     it will be caught and an error message will be shown, then we continue.
 
-    Next, the arguments are preprocessed:
+    Next, :option:`--submit-url` is checked, since it is only required for an upload,
+    and the arguments are preprocessed:
     * :func:`resolve_submit_url` is called on :option:`--submit-url`.
-    * :func:`print_file_hash` is called on :option:`--file`.
+    * :func:`resolve_file_path` is called on :option:`--file`.
+
+    If either is invalid, an error message is shown and we return 1,
+    before anything is hashed or sent.
 
     A :class:`cookielib.CookieJar` object is constructed
     with :option:`--cookie-file` as ``filename``.
@@ -120,7 +142,6 @@ def main_exit_code() -> int:
 
     Finally, save cookies, and return.
 
-    :raises FileNotFoundError: if the file from :option:`--file` does not exist.
     :return: an integer return code to be passed to :func:`sys.exit`
     """
     # load arguments
@@ -132,6 +153,9 @@ def main_exit_code() -> int:
         return 0
 
     # verify submit url
+    # not required by the parser, so --delete-* can be used on their own
+    if args.submit_url is None:
+        parser.error("the following arguments are required: -n/--submit-url")
     submit_url = resolve_submit_url(args.submit_url)
     if submit_url is None:
         print(f"Invalid submit url: '{args.submit_url}'")
@@ -139,8 +163,21 @@ def main_exit_code() -> int:
         print(URL_SUBMIT_EXAMPLE)
         return 1
 
-    # check zip to be uploaded exists
-    file_path = print_file_hash(args.file)
+    # find zip to be uploaded
+    try:
+        file_path = resolve_file_path(args.file)
+    except FileNotFoundError:
+        print(f"File not found: '{args.file}'")
+        return 1
+    except OSError as error:
+        print(f"Can't read file: '{args.file}' ({error.strerror})")
+        return 1
+    if file_path is None:
+        print(f"Not a file: '{args.file}'")
+        return 1
+
+    # only import requests and lxml now that we know they're needed
+    from .requests import run_requests_session
 
     run_requests_session(args=args, file_path=file_path, submit_url=submit_url)
 
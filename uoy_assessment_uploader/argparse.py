@@ -1,12 +1,13 @@
 """Helper functions for parsing command line arguments."""
 
 import argparse
+import functools
 from pathlib import Path
 from typing import Optional, Sequence
 
 from .constants import NAME
 
-DEFAULT_ARG_FILE = "exam.zip"
+DEFAULT_ARG_FILE = Path("exam.zip")
 DEFAULT_ARG_COOKIE_FILE_NAME = "cookies.txt"
 DEFAULT_ARG_COOKIE_FILE = Path.home() / ".cache" / NAME / DEFAULT_ARG_COOKIE_FILE_NAME
 
@@ -17,9 +18,10 @@ class Namespace(argparse.Namespace):
     username: Optional[str]
     password: Optional[str]
     exam_number: Optional[str]
-    submit_url: str
+    submit_url: Optional[str]
     file: Path
     dry_run: bool
+    print_hash: bool
     use_keyring: bool
     delete_from_keyring: bool
     cookie_file: Path
@@ -38,9 +40,12 @@ class ArgumentParser(argparse.ArgumentParser):
         return super().parse_args(args, namespace)
 
 
+@functools.lru_cache(maxsize=1)
 def get_parser() -> ArgumentParser:
     """Construct argument parser, add arguments for this script, and return it.
 
+    The parser is only built once, later calls return the same instance.
+
     Constants:
         :data:`__doc__` the module docstring is used for the parser's description.
         :const:`DEFAULT_ARG_FILE` Path object to use by default for :option:`--file`.
@@ -54,8 +59,8 @@ def get_parser() -> ArgumentParser:
     parser.add_argument(
         "-n",
         "--submit-url",
-        required=True,
-        help="The specific exam to upload to, e.g. /2021-2/submit/COM00012C/901/A",
+        help="The specific exam to upload to, e.g. /2021-2/submit/COM00012C/901/A."
+        " Required, unless only deleting saved data.",
     )
     parser.add_argument(
         "-u", "--username", help="Username for login, not email address, e.g. ab1234"
@@ -80,6 +85,12 @@ def get_parser() -> ArgumentParser:
         action="store_true",
         help="Log in but don't actually upload the file.",
     )
+    parser.add_argument(
+        "--no-print-hash",
+        action="store_false",
+        dest="print_hash",
+        help="Don't hash the file to compare with the confirmation email.",
+    )
 
     # keyring store
     parser.add_argument(
@@ -113,7 +124,7 @@ def get_parser() -> ArgumentParser:
     parser.add_argument(
         "--delete-cookies",
         action="store_true",
-        help="Delete cookie file, then exit.",
+        help="Delete cookie file and saved token, then exit.",
     )
 
     return parser
@@ -0,0 +1,127 @@
+"""Helper functions for saving and loading the session cookies and csrf-token between runs."""
+
+import os
+from http.cookiejar import MISSING_FILENAME_TEXT, Cookie, LWPCookieJar
+from pathlib import Path
+from typing import Optional
+
+# the csrf-token is saved next to the cookie file
+TOKEN_FILE_SUFFIX = ".token"
+# the cookie and token files are written here first, then renamed over the real ones
+TEMP_FILE_SUFFIX = ".tmp"
+
+
+class ChangeTrackingCookieJar(LWPCookieJar):
+    """LWP cookie jar which remembers whether it has changed since it was loaded or saved.
+
+    Saving is also atomic, so an interrupted run can't leave a half-written cookie file.
+
+    >>> import os, tempfile
+    >>> from requests.cookies import create_cookie
+    >>> folder = tempfile.TemporaryDirectory()
+    >>> cookie_file = os.path.join(folder.name, "cookies.txt")
+    >>> cookies = ChangeTrackingCookieJar(cookie_file)
+    >>> cookies.set_cookie(create_cookie("name", "value", domain="example.com"))
+    >>> cookies.changed
+    True
+    >>> cookies.save(ignore_discard=True)
+    >>> cookies.changed
+    False
+    >>> os.listdir(folder.name)
+    ['cookies.txt']
+    >>> cookies = ChangeTrackingCookieJar(cookie_file)
+    >>> cookies.load(ignore_discard=True)
+    >>> cookies.changed, len(cookies)
+    (False, 1)
+    >>> folder.cleanup()
+    """
+
+    def __init__(self, filename=None, delayload=False, policy=None):
+        super().__init__(filename, delayload, policy)
+        self.changed = False
+
+    def set_cookie(self, cookie: Cookie):
+        super().set_cookie(cookie)
+        self.changed = True
+
+    def clear(self, domain=None, path=None, name=None):
+        super().clear(domain, path, name)
+        self.changed = True
+
+    def load(self, filename=None, ignore_discard=False, ignore_expires=False):
+        super().load(filename, ignore_discard, ignore_expires)
+        self.changed = False
+
+    def save(self, filename=None, ignore_discard=False, ignore_expires=False):
+        """Write the cookies to a temporary file, then rename it over ``filename``.
+
+        :param filename: path to save to, defaults to :attr:`filename`
+        :param ignore_discard: save even cookies set to be discarded
+        :param ignore_expires: save even cookies that have expired
+        """
+        if filename is None:
+            if self.filename is None:
+                raise ValueError(MISSING_FILENAME_TEXT)
+            filename = self.filename
+        temp_filename = f"{filename}{TEMP_FILE_SUFFIX}"
+        super().save(temp_filename, ignore_discard, ignore_expires)
+        os.replace(temp_filename, filename)
+        self.changed = False
+
+
+def load_cookies(cookies: LWPCookieJar):
+    """Try to call the cookie jar's :meth:`cookies.load` method.
+
+    ignore_discard is used.
+    If the file :attr:`cookies.filename` doesn't exist, this function will
+    catch FileNotFoundError and print an error message.
+
+    :param cookies: cookie jar to load
+    """
+    print(f"Loading cookie file '{cookies.filename}'")
+    try:
+        cookies.load(ignore_discard=True)
+        print("Loaded cookies.")
+    except FileNotFoundError:
+        print("No cookies to load!")
+
+
+def get_token_file(cookie_file: Path) -> Path:
+    """Get the path to save the csrf-token to, next to the cookie file.
+
+    >>> get_token_file(Path("cookies.txt")).name
+    'cookies.token'
+
+    :param cookie_file: path of the cookie file, from :option:`--cookie-file`
+    :return: the cookie file path, with the suffix replaced by :const:`TOKEN_FILE_SUFFIX`
+    """
+    return cookie_file.with_suffix(TOKEN_FILE_SUFFIX)
+
+
+def load_token(token_file: Path) -> Optional[str]:
+    """Read the csrf-token saved by the last run, if there is one.
+
+    :param token_file: path from :func:`get_token_file`
+    :return: the saved token, or None if the file doesn't exist
+    """
+    try:
+        return token_file.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+
+def save_token(token_file: Path, csrf_token: str):
+    """Save the csrf-token, to try to reuse it next time.
+
+    Like :meth:`ChangeTrackingCookieJar.save`, this writes to a temporary file,
+    then renames it over ``token_file``.
+
+    :param token_file: path from :func:`get_token_file`
+    :param csrf_token: token returned by :func:`run_requests`
+    """
+    # private, like the cookie file which LWPCookieJar.save creates with mode 0600
+    temp_file = token_file.with_name(f"{token_file.name}{TEMP_FILE_SUFFIX}")
+    fd = os.open(temp_file, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+    with open(fd, "w", encoding="utf-8") as file:
+        file.write(csrf_token)
+    os.replace(temp_file, token_file)
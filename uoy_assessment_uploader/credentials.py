@@ -1,13 +1,13 @@
 """Helper functions for getting login details from standard input and from persistent locations."""
 
 import getpass
-from typing import Optional
-
-import keyring
-import keyring.errors
+from typing import TYPE_CHECKING, Optional, Tuple
 
 from .constants import NAME
 
+if TYPE_CHECKING:
+    from keyring.backend import KeyringBackend
+
 # used for service_name in keyring calls
 KEYRING_NAME_PASSWORD = "password"
 KEYRING_NAME_EXAM_NUMBER = "exam-number"
@@ -29,6 +29,9 @@ def delete_keyring_entries(username: str):
 
     :param username: Username passed to :func:`keyring.delete_password`
     """
+    import keyring
+    import keyring.errors
+
     for keyring_name in (KEYRING_NAME_PASSWORD, KEYRING_NAME_EXAM_NUMBER):
         service_name = get_service_name(keyring_name)
         print(f"{keyring_name} - deleting from keyring")
@@ -52,25 +55,48 @@ def ensure_username(username: Optional[str]) -> str:
     return username
 
 
-def ensure_password(username: str, password: Optional[str], use_keyring: bool) -> str:
-    """Wrap :func:`ensure_credential` to fill in ``password`` if it is None.
+def ensure_credentials(
+    username: Optional[str],
+    password: Optional[str],
+    exam_number: Optional[str],
+    use_keyring: bool,
+) -> Tuple[str, str, str]:
+    """Ensure username, password, and exam number are all filled in.
 
-    The extra arguments passed to :func:`ensure_credential` are
-        :const:`KEYRING_NAME_PASSWORD` for ``keyring_name``,
-        and :const:`PROMPT_PASSWORD` for ``prompt``.
+    This calls :func:`ensure_username`, then :func:`ensure_credential`
+    for both the password and the exam number,
+    sharing one keyring backend from :func:`keyring.get_keyring` between them.
 
-    :param username: passed through to :func:`ensure_credential`
+    :param username: passed through to :func:`ensure_username`
     :param password: passed through to :func:`ensure_credential`
+    :param exam_number: passed through to :func:`ensure_credential`
     :param use_keyring: passed through to :func:`ensure_credential`
-    :return: the password returned from :func:`ensure_credential`
+    :return: tuple of the username, password, and exam number
     """
-    return ensure_credential(
+    username = ensure_username(username)
+    backend = None
+    if use_keyring:
+        import keyring
+
+        backend = keyring.get_keyring()
+
+    password = ensure_credential(
         username,
         password,
         use_keyring=use_keyring,
         keyring_name=KEYRING_NAME_PASSWORD,
         prompt=PROMPT_PASSWORD,
+        backend=backend,
     )
+    exam_number = ensure_credential(
+        username,
+        exam_number,
+        use_keyring=use_keyring,
+        keyring_name=KEYRING_NAME_EXAM_NUMBER,
+        prompt=PROMPT_EXAM_NUMBER,
+        backend=backend,
+    )
+    return username, password, exam_number
 
 
 def ensure_exam_number(
@@ -102,6 +128,7 @@ def ensure_credential(
     use_keyring: bool,
     keyring_name: str,
     prompt: str,
+    backend: Optional["KeyringBackend"] = None,
 ) -> str:
     """Ensure ``credential`` is not None by getting it from getpass or from the keyring.
 
@@ -112,20 +139,27 @@ def ensure_credential(
         or the secret passphrase to be returned.
     :param use_keyring: whether to use :mod:`keyring` to save the credential.
         If this is True, this function will attempt to retrieve the credential,
-        using :func:`keyring.get_password`.
+        using the keyring backend's ``get_password``.
         When the credential is not in the keyring, fall back to getpass.
         Finally, the credential is saved to the keyring for next time.
     :param keyring_name: passed to :func:`get_service_name`
         to get the ``service_name`` to pass to :mod:`keyring`
     :param prompt: prompt for :func:`getpass` to use
         if the credential is not retrieved from the keyring.
+    :param backend: keyring backend to use, to avoid looking it up again.
+        If this is None, :func:`keyring.get_keyring` is used.
     :return: the new credential, or the original argument, if it was not None.
     """
+    if use_keyring and backend is None:
+        import keyring
+
+        backend = keyring.get_keyring()
+
     service_name = get_service_name(keyring_name)
     # try keyring
     got_from_keyring = False
     if use_keyring and credential is None:
-        credential = keyring.get_password(service_name, username)
+        credential = backend.get_password(service_name, username)
         if credential is None:
             print(f"{keyring_name} - not in keyring")
             got_from_keyring = False
@@ -137,7 +171,7 @@ def ensure_credential(
         credential = getpass.getpass(prompt)
     # save password to keyring
     if use_keyring and not got_from_keyring:
-        keyring.set_password(service_name, username, credential)
+        backend.set_password(service_name, username, credential)
         print(f"{keyring_name} - saved to keyring")
 
     return credential
@@ -0,0 +1,138 @@
+"""Helper functions for hashing the submitted file, to check it against the confirmation email."""
+
+import hashlib
+import mmap
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+# 1 MiB
+HASH_BUFFER_SIZE = 1 << 20
+
+
+def get_file_digest(file_path: Path) -> str:
+    """Read the whole file and return its MD5 checksum.
+
+    The file is memory-mapped and hashed in one call,
+    so the whole loop runs inside hashlib instead of in Python.
+    Files which can't be mapped, such as empty files and pipes,
+    are read with :func:`get_file_digest_buffered` instead.
+
+    :param file_path: path of the file to hash
+    :return: the hex digest of the file's MD5 hash
+    """
+    with open(file_path, "rb", buffering=0) as file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return get_file_digest_buffered(file)
+        with mapped:
+            return hashlib.md5(mapped).hexdigest()
+
+
+def get_file_digest_buffered(file: BinaryIO) -> str:
+    """Read the rest of an open file and return its MD5 checksum, without memory-mapping it.
+
+    The file is read into one reused buffer of :const:`HASH_BUFFER_SIZE` bytes,
+    to keep the number of reads and allocations down for large files.
+
+    >>> import io
+    >>> get_file_digest_buffered(io.BytesIO(b"hello"))
+    '5d41402abc4b2a76b9719d911017c592'
+
+    :param file: file opened in binary mode, ideally unbuffered
+    :return: the hex digest of the file's MD5 hash
+    """
+    file_hash = hashlib.md5()
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while size := file.readinto(buffer):
+        file_hash.update(view[:size])
+    return file_hash.hexdigest()
+
+
+def start_file_digest(file_path: Path) -> Future:
+    """Run :func:`get_file_digest` in a background thread.
+
+    The thread is a daemon, unlike a :class:`ThreadPoolExecutor` worker,
+    so if the run fails before the digest is needed, e.g. during login,
+    the interpreter can exit straight away instead of waiting for a large file to be hashed.
+
+    >>> start_file_digest(Path(__file__)).result() == get_file_digest(Path(__file__))
+    True
+
+    :param file_path: passed through to :func:`get_file_digest`
+    :return: a future for the hex digest, or for the exception raised while hashing
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(get_file_digest(file_path))
+        except BaseException as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def print_digest(digest: str):
+    """Print the file's checksum, in the same format as the confirmation email.
+
+    :param digest: hex digest from :func:`get_file_digest` or :class:`HashingReader`
+    """
+    print(f"MD5 hash of file: {digest}")
+
+
+class HashingReader:
+    """Memory-mapped file reader for :class:`MultipartEncoder`, which hashes everything read.
+
+    This lets the file be hashed while it is being uploaded,
+    instead of reading it from disk twice.
+
+    >>> import tempfile
+    >>> from requests_toolbelt.multipart.encoder import MultipartEncoder
+    >>> with tempfile.TemporaryFile() as file:
+    ...     _ = file.write(b"exam answers" * 10000)
+    ...     _ = file.seek(0)
+    ...     with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+    ...         file_hash = hashlib.md5()
+    ...         reader = HashingReader(mapped, file_hash)
+    ...         form_data = MultipartEncoder(fields={"file": ("exam.zip", reader)})
+    ...         content_length = form_data.len
+    ...         body = form_data.read()
+    >>> file_hash.hexdigest() == hashlib.md5(b"exam answers" * 10000).hexdigest()
+    True
+    >>> len(body) == content_length
+    True
+    """
+
+    def __init__(self, file: mmap.mmap, hash_object: Optional["hashlib._Hash"]):
+        """Wrap ``file``, which should be at position 0.
+
+        :param file: memory-mapped file to read from
+        :param hash_object: hash object from :mod:`hashlib`,
+            which is updated with each chunk read from ``file``,
+            or None to just read the file without hashing it
+        """
+        self.file = file
+        self.hash_object = hash_object
+
+    @property
+    def len(self) -> int:
+        """Number of bytes left to read, as used by :class:`MultipartEncoder`."""
+        return len(self.file) - self.file.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes from the file, and add them to the hash.
+
+        :param size: maximum number of bytes to read, or -1 to read until EOF
+        :return: the bytes read
+        """
+        chunk = self.file.read(size)
+        if self.hash_object is not None:
+            self.hash_object.update(chunk)
+        return chunk
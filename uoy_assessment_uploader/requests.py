@@ -1,42 +1,127 @@
 """Functions to carry out the actual login and submission process, using :mod:`requests`."""
 
+import hashlib
+import io
+import mmap
+import os
+import re
+import stat
+import time
 import urllib.parse
-from http.cookiejar import LWPCookieJar
+from contextlib import ExitStack
+from http.cookiejar import CookieJar
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 
 import requests.utils
-from bs4 import BeautifulSoup
 from requests import Response, Session
+from requests.adapters import HTTPAdapter, Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from .argparse import Namespace
-from .constants import NAME, URL_EXAM_NUMBER, URL_LOGIN, __version__
-from .credentials import ensure_exam_number, ensure_password, ensure_username
+from .constants import NAME, URL_EXAM_NUMBER, URL_LOGIN, URL_SUBMIT_BASE, __version__
+from .cookies import (
+    ChangeTrackingCookieJar,
+    get_token_file,
+    load_cookies,
+    load_token,
+    save_token,
+)
+from .credentials import ensure_credentials, ensure_exam_number, ensure_username
+from .hashing import HashingReader, print_digest, start_file_digest
 
 # user agent
 # should be like "python-requests/x.y.z"
 USER_AGENT_DEFAULT = requests.utils.default_user_agent()
 USER_AGENT = f"{USER_AGENT_DEFAULT} {NAME}/{__version__}"
 
+# pages the submit url can redirect to, keyed by url without the query string
+URL_LOGIN_BASE, _, URL_LOGIN_QUERY = URL_LOGIN.partition("?")
+ROUTE_LOGIN = "login"
+ROUTE_EXAM_NUMBER = "exam-number"
+ROUTE_SUBMIT = "submit"
+ROUTES = {
+    URL_LOGIN_BASE: ROUTE_LOGIN,
+    URL_EXAM_NUMBER: ROUTE_EXAM_NUMBER,
+}
+
+# the meta tag holding the csrf-token, on Teaching Portal pages
+RE_CSRF_TOKEN_META = re.compile(rb'<meta[^>]+name="csrf-token"[^>]+content="([^"]+)"')
+
+# status code the Teaching Portal responds with when the csrf-token has expired
+HTTP_STATUS_PAGE_EXPIRED = 419
+
+# the Shibboleth session cookie set by the Teaching Portal after logging in
+SHIBSESSION_COOKIE_PREFIX = "_shibsession_"
+SHIBSESSION_COOKIE_NAME_LENGTH = len(SHIBSESSION_COOKIE_PREFIX) + 96
+RE_SHIBSESSION_COOKIE_NAME = re.compile(r"_shibsession_[0-9a-z]{96}")
+SESSION_COOKIE_DOMAIN = urllib.parse.urlparse(URL_SUBMIT_BASE).hostname
+
+# connection pool
+# only two hosts are ever contacted, teaching.cs.york.ac.uk and shib.york.ac.uk
+POOL_CONNECTIONS = 2
+POOL_MAXSIZE = 4
+# retry transient server errors from either host, with backoff
+# only idempotent methods (urllib3's default) are retried:
+# the login and upload POSTs are one-shot, and the streamed upload body can't be rewound
+RETRY = Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=(500, 502, 503, 504),
+    raise_on_status=False,
+)
+
+
+def raise_for_status_hook(response: Response, *args, **kwargs):
+    """Response hook which calls :meth:`Response.raise_for_status` on every response.
+
+    Registered on the session by :func:`run_requests_session`,
+    so the functions making requests don't need to check each response themselves.
+
+    :param response: HTTP response passed to the hook by :mod:`requests`
+    :param args: other positional arguments passed to hooks, ignored
+    :param kwargs: other keyword arguments passed to hooks, ignored
+    :raises requests.HTTPError: if the response is not OK
+    """
+    response.raise_for_status()
+
 
 def get_token(response: Response, login_page: bool = False) -> str:
     """Get the CS Portal token from the HTTP response.
 
     The token is taken from the value of form input element csrf_token, on the login page,
     or from the content of the meta tag csrf-token, for all other webpages.
+    The meta tag is first searched for with :const:`RE_CSRF_TOKEN_META`,
+    and the page is only parsed as HTML if that doesn't match,
+    straight from the raw bytes so the response body is never decoded to text.
+
+    >>> from types import SimpleNamespace
+    >>> page = b'<meta name="csrf-token" content="Tq2mCxl9">'
+    >>> get_token(SimpleNamespace(content=page))
+    'Tq2mCxl9'
 
     :param response: HTTP response from a URL at teaching.cs.york.ac.uk
     :param login_page: If False, parse token from meta tag. If True, parse token from form element.
+    :raises RuntimeError: if the page has no token, e.g. because its layout has changed
     :return: the token, an arbitrary string of letters and numbers used for verification
     """
-    # could switch to Requests-HTML?
-    # https://requests-html.kennethreitz.org/
-    soup = BeautifulSoup(response.text, features="html.parser")
+    if not login_page:
+        # fast path, avoid parsing the whole page
+        match = RE_CSRF_TOKEN_META.search(response.content)
+        if match is not None:
+            return match.group(1).decode()
+
+    import lxml.html
+
+    document = lxml.html.document_fromstring(response.content)
     if login_page:
-        tag = soup.find("input", attrs={"type": "hidden", "name": "csrf_token"})
-        token = tag["value"]
+        token = document.xpath(
+            "string(//input[@type='hidden'][@name='csrf_token']/@value)"
+        )
     else:
-        tag = soup.find("meta", attrs={"name": "csrf-token"})
-        token = tag["content"]
+        token = document.xpath("string(//meta[@name='csrf-token']/@content)")
+    if not token:
+        raise RuntimeError(f"csrf token not found on page {response.url}")
 
     return token
 
@@ -53,7 +138,7 @@ def login_saml(
     :param username: username from :option:`--username` or :func:`credentials.ensure_username`,
         e.g. ``ab1234``
     :param password: password from :option:`--password`, or,
-        more securely, :func:`credentials.ensure_password`
+        more securely, :func:`credentials.ensure_credentials`
     :return: the HTTP response object from the login request, although this is not important,
         as the key part is the cookies which are attached to the session.
     """
@@ -65,37 +150,79 @@ def login_saml(
         "_eventId_proceed": "",
     }
     response = session.post(URL_LOGIN, data=payload)
-    response.raise_for_status()
 
     response = login_saml_continue(session, response)
     return response
 
 
+def parse_saml_form(content: bytes) -> Tuple[Optional[str], Dict[str, str]]:
+    """Read the SAML response form's action URL and hidden inputs from a page.
+
+    The page is read with :func:`lxml.etree.iterparse`,
+    and the rest of the page after the form isn't parsed at all.
+
+    >>> parse_saml_form(
+    ...     b'<input type="hidden" name="before" value="x">'
+    ...     b'<form action="https://example.com/SAML2/POST">'
+    ...     b'<input type="hidden" name="SAMLResponse" value="PHNhbWw+">'
+    ...     b'<input type="hidden" name="RelayState" value="ss:mem:1">'
+    ...     b'<input type="submit" value="Continue">'
+    ...     b'</form>'
+    ...     b'<input type="hidden" name="after" value="y">'
+    ... )
+    ('https://example.com/SAML2/POST', {'SAMLResponse': 'PHNhbWw+', 'RelayState': 'ss:mem:1'})
+    >>> parse_saml_form(b"<p>Wrong password</p>")
+    (None, {})
+
+    :param content: raw HTML of the page
+    :return: the form's action URL, or None if there's no form,
+        and a dict of the names and values of the hidden inputs inside the form
+    """
+    from lxml import etree
+
+    # stop as soon as the form ends
+    action_url = None
+    payload = {}
+    events = etree.iterparse(io.BytesIO(content), events=("start", "end"), html=True)
+    for event, element in events:
+        if element.tag == "form":
+            if event == "end":
+                break
+            action_url = element.get("action")
+        elif (
+            event == "start"
+            and action_url is not None
+            and element.tag == "input"
+            and element.get("type") == "hidden"
+        ):
+            payload[element.get("name")] = element.get("value", "")
+    return action_url, payload
+
+
 def login_saml_continue(session: Session, response: Response) -> Response:
     """Perform the second step of the SAML SSO login.
 
+    The SAML response form is read with :func:`parse_saml_form`,
+    then sent back to the Teaching Portal.
+
     :param session: the HTTP session
         to make requests with and persist cookies onto
     :param response: HTTP response from the first login step
+    :raises RuntimeError: if the page has no form with an action,
+        e.g. because the login was rejected or the page layout has changed
     :return: the HTTP response object from the login request
     """
-    # parse saml response
-    soup = BeautifulSoup(response.text, features="html.parser")
-    form = soup.find("form")
-    action_url = form.attrs["action"]
-    form_inputs = form.find_all("input", attrs={"type": "hidden"})
-    payload = {}
-    for element in form_inputs:
-        payload[element["name"]] = element["value"]
+    action_url, payload = parse_saml_form(response.content)
+    if not action_url:
+        raise RuntimeError(f"SAML response form not found on page {response.url}")
 
     # send saml response back to teaching portal
     response = session.post(action_url, data=payload)
-    response.raise_for_status()
     return response
 
 
 def login_exam_number(session: Session, csrf_token: str, exam_number: str) -> Response:
-    """Secondary login to the Teaching Portal, sending the exam number credential using POST.
+    """Secondary login to the Teaching Portal, sending the exam number credential using a POST form.
 
     :param session: the HTTP session
         to make requests with and persist cookies onto
@@ -112,13 +239,16 @@ def login_exam_number(session: Session, csrf_token: str, exam_number: str) -> Re
         "_token": csrf_token,
         "examNumber": exam_number,
     }
-    response = session.post(URL_EXAM_NUMBER, params=params)
-    response.raise_for_status()
+    response = session.post(URL_EXAM_NUMBER, data=params)
     return response
 
 
 def upload_assignment(
-    session: Session, csrf_token: str, submit_url: str, file_path: Path
+    session: Session,
+    csrf_token: str,
+    submit_url: str,
+    file_path: Path,
+    file_hash: Optional["hashlib._Hash"] = None,
 ) -> Response:
     """Upload the completed exam file to the Teaching Portal using POST.
 
@@ -128,68 +258,221 @@ def upload_assignment(
         from :func:`get_token`
     :param submit_url: the url to submit to, passed verbatim to :meth:`session.post`
         e.g. https://teaching.cs.york.ac.uk/student/2021-2/submit/COM00012C/901/A
-    :param file_path: file path to pass to the ``files`` parameter of :meth:`session.post`,
-        opened in mode ``rb`` (read bytes).
+    :param file_path: file path to open in mode ``rb`` (read bytes) and memory-map,
+        then stream from the page cache as the ``file`` field of the multipart form,
+        using :class:`MultipartEncoder` so the whole file is never copied into memory.
+        Files which can't be mapped, such as empty files and pipes
+        (e.g. process substitution), are read into memory instead.
+    :param file_hash: if given, this hash object from :mod:`hashlib`
+        is updated with the file's contents as they are uploaded, using :class:`HashingReader`.
     :return: the HTTP response object from the submit request
     """
-    with open(file_path, "rb") as file:
-        file_dict = {"file": (file_path.name, file)}
-        form_data = {"ownwork": 1, "_token": csrf_token}
-        response = session.post(url=submit_url, data=form_data, files=file_dict)
+    with ExitStack() as stack:
+        file = stack.enter_context(open(file_path, "rb"))
+        file_stat = os.fstat(file.fileno())
+        mapped = None
+        # only regular files have a size to map, mmap can't map an empty file
+        if stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > 0:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass
+        if mapped is None:
+            body = file.read()
+            if file_hash is not None:
+                file_hash.update(body)
+        else:
+            stack.enter_context(mapped)
+            body = HashingReader(mapped, file_hash)
+        form_data = MultipartEncoder(
+            fields={
+                "ownwork": "1",
+                "_token": csrf_token,
+                "file": (file_path.name, body),
+            }
+        )
+        headers = {"Content-Type": form_data.content_type}
+        response = session.post(url=submit_url, data=form_data, headers=headers)
     return response
 
 
+def get_route(url: str, submit_url: str) -> Optional[str]:
+    """Look up which page of the login process a response ended up on.
+
+    >>> get_route(URL_LOGIN, submit_url="")
+    'login'
+    >>> get_route(URL_EXAM_NUMBER, submit_url="")
+    'exam-number'
+    >>> assert get_route("https://example.com/", submit_url="") is None
+
+    :param url: final URL of the response, after redirects
+    :param submit_url: the submit page URL, which is a route on its own
+    :return: one of the values in :const:`ROUTES`, or :const:`ROUTE_SUBMIT`,
+        or None if the URL is unexpected
+    """
+    url_base = url.partition("?")[0]
+    route = ROUTES.get(url_base)
+    if route is None and url == submit_url:
+        route = ROUTE_SUBMIT
+    return route
+
+
+def has_session_cookie(cookies: CookieJar) -> bool:
+    """Check whether the cookie jar has a live Shibboleth session cookie for the Teaching Portal.
+
+    >>> from requests.cookies import RequestsCookieJar, create_cookie
+    >>> name = SHIBSESSION_COOKIE_PREFIX + "0a" * 48
+    >>> cookies = RequestsCookieJar()
+    >>> cookies.set_cookie(create_cookie(name, "x", domain="shib.york.ac.uk"))
+    >>> has_session_cookie(cookies)
+    False
+    >>> cookies.set_cookie(create_cookie(name, "x", domain=SESSION_COOKIE_DOMAIN, expires=1))
+    >>> has_session_cookie(cookies)
+    False
+    >>> cookies.set_cookie(create_cookie(name, "x", domain=SESSION_COOKIE_DOMAIN))
+    >>> has_session_cookie(cookies)
+    True
+
+    :param cookies: cookie jar to search
+    :return: True if an unexpired cookie for :const:`SESSION_COOKIE_DOMAIN`
+        has a name matching :const:`RE_SHIBSESSION_COOKIE_NAME`
+    """
+    now = time.time()
+    for cookie in cookies:
+        if not cookie.domain.endswith(SESSION_COOKIE_DOMAIN):
+            continue
+        if cookie.is_expired(now):
+            continue
+        name = cookie.name
+        # cheap checks first, so most cookies never reach the regex
+        if len(name) != SHIBSESSION_COOKIE_NAME_LENGTH:
+            continue
+        if not name.startswith(SHIBSESSION_COOKIE_PREFIX):
+            continue
+        if RE_SHIBSESSION_COOKIE_NAME.fullmatch(name):
+            return True
+    return False
+
+
+def upload_file(
+    session: Session,
+    csrf_token: str,
+    submit_url: str,
+    file_path: Path,
+    print_hash: bool,
+) -> bool:
+    """Upload the file using :func:`upload_assignment`, then print its hash.
+
+    :param session: passed through to :func:`upload_assignment`
+    :param csrf_token: passed through to :func:`upload_assignment`
+    :param submit_url: passed through to :func:`upload_assignment`
+    :param file_path: passed through to :func:`upload_assignment`
+    :param print_hash: whether to hash the file as it is uploaded, and print the hash
+    :raises requests.HTTPError: from :func:`raise_for_status_hook`,
+        if the upload response is not OK.
+    :return: True if the file was uploaded.
+        False if the response landed on the login or exam number page instead,
+        or was rejected because the token has expired, meaning we need to log in again.
+    """
+    file_hash = hashlib.md5() if print_hash else None
+    try:
+        response = upload_assignment(
+            session,
+            csrf_token,
+            submit_url,
+            file_path,
+            file_hash=file_hash,
+        )
+    except requests.HTTPError as error:
+        if error.response.status_code == HTTP_STATUS_PAGE_EXPIRED:
+            return False
+        raise
+    if get_route(response.url, submit_url) in ROUTES.values():
+        return False
+    print("Uploaded fine.")
+    if file_hash is not None:
+        print_digest(file_hash.hexdigest())
+    return True
+
+
 def run_requests(
     session: Session,
     args: Namespace,
     submit_url: str,
     file_path: Path,
-):
+    csrf_token: Optional[str] = None,
+) -> str:
     """Run the actual upload process, using direct HTTP requests.
 
     Login process:
     A :class:`requests.Session` is used for all steps, to save the cookies between http calls.
 
+    0. If ``csrf_token`` was saved from last time and the cookies include a session cookie
+       (see :func:`has_session_cookie`), try uploading straight away with :func:`upload_file`.
+       This is skipped unless the file is a regular file, which can be read again if it fails.
+       If that works, we're done. Otherwise, carry on and log in again.
     1. Request the submit page.
-       The redirect in the response is used to figure out which parts of 3. are needed.
+       The redirect in the response is looked up in :const:`ROUTES`
+       to figure out which parts of 3. are needed.
     2. Get the csrf-token from the response using :func:`get_token`
     3. Authentication
         1. If login is needed, follow the SAML auth process with requests, then proceed to 3.2.
-           First we make sure we have both username and password,
-           using :func:`ensure_username` and :func:`ensure_password`. Making these optional means
+           First we make sure we have the username, password and exam number,
+           using :func:`ensure_credentials`. Making these optional means
            we don't have to retrieve them if the saved cookies allow us to go right ahead.
            Then we do the login process using :func:`login_saml`.
         2. If the exam number is needed, submit the exam number.
            First we make sure we have the exam number using :func:`ensure_exam_number`.
            Then we send it using :func:`login_exam_number`.
-    4. Upload the actual file using :func:`upload_assignment`.
-
-    :param session: the HTTP session to make requests with and persist cookies onto
+    4. Upload the actual file using :func:`upload_file`,
+       hashing it as it is read, then print the hash.
+       On a dry run, the file is just hashed with :func:`start_file_digest` instead,
+       in a background thread which is started before 1. so it overlaps with logging in.
+       If :option:`--no-print-hash` is set, the file is not hashed at all.
+
+    :param session: the HTTP session to make requests with and persist cookies onto,
+        with :func:`raise_for_status_hook` registered
     :param args: command line arguments namespace containing credentials
     :param submit_url: url passed through to :func:`upload_assignment`
     :param file_path: file path also passed through to :func:`upload_assignment`
-    :raises requests.HTTPError: from :meth:`Response.raise_for_status`,
+    :param csrf_token: token saved from a previous run by :func:`save_token`, if any
+    :raises requests.HTTPError: from :func:`raise_for_status_hook`,
         if any response during the process is not OK.
+    :return: the csrf-token used for the upload, to be saved for next time
     """
     dry_run = args.dry_run
+    print_hash = args.print_hash
     use_keyring = args.use_keyring
 
-    response = session.get(submit_url)
-    response.raise_for_status()
+    digest_future = None
+    if dry_run and print_hash:
+        # nothing will be uploaded to hash along the way,
+        # so hash the file in the background while logging in
+        digest_future = start_file_digest(file_path)
+
+    # a pipe can only be read once, so it can't be sent again if the saved session has expired
+    if (
+        csrf_token is not None
+        and not dry_run
+        and file_path.is_file()
+        and has_session_cookie(session.cookies)
+    ):
+        print("Uploading file using saved session...")
+        if upload_file(session, csrf_token, submit_url, file_path, print_hash):
+            return csrf_token
+        print("Saved session has expired.")
 
-    parsed_base = urllib.parse.urlparse(URL_LOGIN)
-    parsed = urllib.parse.urlparse(response.url)
+    response = session.get(submit_url)
 
-    if (parsed.hostname, parsed.path) == (parsed_base.hostname, parsed_base.path):
+    route = get_route(response.url, submit_url)
+    if route == ROUTE_LOGIN:
         print("Logging in..")
 
-        if parsed.query == parsed_base.query:
+        if response.url.partition("?")[2] == URL_LOGIN_QUERY:
             # full login required
             print("Logging in from scratch.")
-            username = ensure_username(args.username)
-            password = ensure_password(username, args.password, use_keyring=use_keyring)
-            exam_number = ensure_exam_number(
-                username, args.exam_number, use_keyring=use_keyring
+            username, password, exam_number = ensure_credentials(
+                args.username, args.password, args.exam_number, use_keyring=use_keyring
             )
 
             csrf_token = get_token(response, login_page=True)
@@ -208,16 +491,14 @@ def run_requests(
             )
             response = login_saml_continue(session, response)
 
-        response.raise_for_status()
         print("Logged in.")
 
         print("Entering exam number..")
         # the token changes after login
         csrf_token = get_token(response)
         response = login_exam_number(session, csrf_token, exam_number)
-        response.raise_for_status()
         print("Entered exam number.")
-    elif response.url == URL_EXAM_NUMBER:
+    elif route == ROUTE_EXAM_NUMBER:
         csrf_token = get_token(response)
         print("Entering exam number..")
         exam_number = ensure_exam_number(
@@ -225,7 +506,7 @@ def run_requests(
         )
         login_exam_number(session, csrf_token, exam_number)
         print("Entered exam number.")
-    elif response.url == submit_url:
+    elif route == ROUTE_SUBMIT:
         csrf_token = get_token(response)
     else:
         raise RuntimeError(f"Unexpected redirect '{response.url}'")
@@ -233,57 +514,68 @@ def run_requests(
     print("Uploading file...")
     if dry_run:
         print("Skipped actual upload.")
-    else:
-        response = upload_assignment(session, csrf_token, submit_url, file_path)
-        response.raise_for_status()
-        print("Uploaded fine.")
+        if digest_future is not None:
+            print_digest(digest_future.result())
+    elif not upload_file(session, csrf_token, submit_url, file_path, print_hash):
+        raise RuntimeError("Upload was sent back to login, even after logging in")
+
+    return csrf_token
 
 
-def run_requests_session(args: Namespace, file_path: Path, submit_url: str):
-    """Create a session, attach cookies and CA cert file, then run.
+def run_requests_session(
+    args: Namespace,
+    file_path: Path,
+    submit_url: str,
+):
+    """Create a session, attach cookies and a retrying connection pool, then run.
+
+    The csrf-token is saved alongside the cookies,
+    in the file from :func:`get_token_file`,
+    so the next run can try to upload without logging in again.
+    Neither file is rewritten if it hasn't changed since it was loaded.
 
     :param args: command line arguments object
     :param file_path: passed through to :func:`run_requests`
     :param submit_url: passed through to :func:`run_requests`
     """
     # load cookies
-    cookies = LWPCookieJar(args.cookie_file)
+    cookies = ChangeTrackingCookieJar(args.cookie_file)
+    token_file = get_token_file(args.cookie_file)
+    csrf_token = None
+    saved_token = None
     # create cookie file's folder if it doesn't exist
     args.cookie_file.parent.mkdir(parents=True, exist_ok=True)
     if args.save_cookies:
         load_cookies(cookies)
+        saved_token = csrf_token = load_token(token_file)
 
     with Session() as session:
         # session setup
         session.cookies = cookies
         session.headers.update({"User-Agent": USER_AGENT})
+        session.hooks["response"].append(raise_for_status_hook)
+        adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=POOL_MAXSIZE,
+            max_retries=RETRY,
+        )
+        session.mount("https://", adapter)
 
-        run_requests(
+        csrf_token = run_requests(
             session=session,
             args=args,
             submit_url=submit_url,
             file_path=file_path,
+            csrf_token=csrf_token,
         )
 
         # save cookies
         if args.save_cookies:
-            print(f"Saving cookie file '{cookies.filename}'")
-            cookies.save(ignore_discard=True)
-            print("Saved cookies.")
-
-
-def load_cookies(cookies: LWPCookieJar):
-    """Try to call the cookie jar's :meth:`cookies.load` method.
-
-    ignore_discard is used.
-    If the file :attr:`cookies.filename` doesn't exist, this function will
-    catch FileNotFoundError and print an error message.
-
-    :param cookies: cookie jar to load
-    """
-    print(f"Loading cookie file '{cookies.filename}'")
-    try:
-        cookies.load(ignore_discard=True)
-        print("Loaded cookies.")
-    except FileNotFoundError:
-        print("No cookies to load!")
+            if cookies.changed:
+                print(f"Saving cookie file '{cookies.filename}'")
+                cookies.save(ignore_discard=True)
+                print("Saved cookies.")
+            else:
+                print("Cookies unchanged, not saving.")
+            if csrf_token != saved_token:
+                save_token(token_file, csrf_token)